@@ -1,9 +1,17 @@
 from flask import Flask, request, jsonify
 import logging
 import json
-from typing import Dict, Any, List
+import math
+import os
+import time
+import uuid
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Callable, Tuple
 from dotenv import load_dotenv
-from provider import DatabaseProvider, DatabasePatterns, AIDatabaseAdvisor
+from provider import DatabaseProvider, DatabasePatterns, AIDatabaseAdvisor, OrchestratorDeliveryQueue
+from profiling import profile_requests
 
 # Carregar variáveis de ambiente
 load_dotenv()
@@ -14,6 +22,18 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
+# Header com o orçamento de tempo restante do cliente (segundos). O mesmo valor
+# pode vir no corpo como "request_timeout"
+DEADLINE_HEADER = "X-Request-Timeout"
+# Folga reservada para montar e enviar a resposta antes do prazo do cliente
+DEADLINE_MARGIN_SECONDS = float(os.getenv("DEADLINE_MARGIN_SECONDS", "1.0"))
+
+SECTION_CACHE_SIZE = int(os.getenv("SECTION_CACHE_SIZE", "1024"))
+ANALYSIS_STORE_SIZE = int(os.getenv("ANALYSIS_STORE_SIZE", "256"))
+
+# Entrega assíncrona dos resultados ao orquestrador (desativada por padrão)
+ORCHESTRATOR_DELIVERY_ENABLED = os.getenv("ORCHESTRATOR_DELIVERY_ENABLED", "false").lower() == "true"
+
 class DatabaseProvider:
     def __init__(self):
         self.orchestrator_url = "http://localhost:3000"
@@ -69,6 +89,93 @@ class DatabasePatterns:
             "use_cases": ["Cache", "Sessões de usuário", "Configurações"]
         }
 
+class LRUCache:
+    """Cache LRU limitado e thread-safe"""
+    
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key: str) -> Any:
+        with self._lock:
+            if key not in self._items:
+                return None
+            self._items.move_to_end(key)
+            return self._items[key]
+    
+    def set(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+class AnalysisSection:
+    """Seção da análise, memoizada pelos campos de entrada dos quais depende
+    
+    `fields` são caminhos no corpo da requisição (ex.: "requirements.data_type")
+    e `depends_on` são seções cujo resultado alimenta esta. `compute` recebe
+    (data, results, context) e `cacheable(context)` decide se o valor pode
+    ser reaproveitado por outras requisições.
+    """
+    
+    def __init__(self, name: str, fields: Tuple[str, ...], compute: Callable,
+                 depends_on: Tuple[str, ...] = (), cacheable: Callable = None):
+        self.name = name
+        self.fields = fields
+        self.compute = compute
+        self.depends_on = depends_on
+        self.cacheable = cacheable or (lambda context: True)
+    
+    def cache_key(self, data: Dict[str, Any], upstream_keys: Dict[str, str]) -> str:
+        """Chave derivada apenas das entradas declaradas da seção"""
+        payload = {
+            "section": self.name,
+            "inputs": {field: _get_field(data, field) for field in self.fields},
+            "upstream": [upstream_keys[name] for name in self.depends_on]
+        }
+        encoded = json.dumps(payload, sort_keys=True, default=str)
+        return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+def _get_field(data: Dict[str, Any], path: str) -> Any:
+    """Resolve um caminho pontuado no corpo da requisição"""
+    value = data
+    for part in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+section_cache = LRUCache(SECTION_CACHE_SIZE)
+analysis_store = LRUCache(ANALYSIS_STORE_SIZE)
+
+# Criada na inicialização de cada processo que atende requisições (bloco
+# __main__ abaixo e post_worker_init em gunicorn.conf.py), o que já reenvia o
+# spool pendente. Na importação ela também rodaria no processo pai do
+# reloader e antes do fork do gunicorn, com o pid (e o spool) errados
+_delivery_queue = None
+_delivery_queue_lock = threading.Lock()
+
+def get_delivery_queue() -> Optional[OrchestratorDeliveryQueue]:
+    """Fila de entrega deste processo, ou None se a entrega estiver desativada"""
+    global _delivery_queue
+    if not ORCHESTRATOR_DELIVERY_ENABLED:
+        return None
+    
+    with _delivery_queue_lock:
+        if _delivery_queue is None:
+            _delivery_queue = OrchestratorDeliveryQueue(
+                os.getenv("ORCHESTRATOR_URL", "http://localhost:3000"),
+                endpoint=os.getenv("ORCHESTRATOR_DELIVERY_ENDPOINT", "database-results"),
+                batch_size=int(os.getenv("DELIVERY_BATCH_SIZE", "20")),
+                batch_window=float(os.getenv("DELIVERY_BATCH_WINDOW", "2.0")),
+                spool_dir=os.getenv("DELIVERY_SPOOL_DIR", ".delivery_spool"),
+                max_spool_items=int(os.getenv("DELIVERY_MAX_SPOOL_ITEMS", "500")),
+                max_attempts=int(os.getenv("DELIVERY_MAX_ATTEMPTS", "8"))
+            )
+        return _delivery_queue
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Endpoint de health check"""
@@ -78,12 +185,23 @@ def health_check():
         "framework": "flask"
     })
 
+@app.route('/metrics/delivery', methods=['GET'])
+def delivery_metrics():
+    """Métricas da entrega assíncrona ao orquestrador"""
+    delivery_queue = get_delivery_queue()
+    if delivery_queue is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **delivery_queue.get_metrics()})
+
 @app.route('/analyze-database', methods=['POST'])
+@profile_requests
 def analyze_database():
     """
     Endpoint principal para análise de banco de dados
     """
     try:
+        started_at = time.monotonic()
+        
         # Obter dados da requisição
         data = request.get_json()
         
@@ -95,38 +213,62 @@ def analyze_database():
         if not provider.validate_project_data(data):
             return jsonify({"success": False, "error": "Dados do projeto inválidos"}), 400
         
-        # 🔥 NOVO: Obter recomendação de IA
-        ai_advisor = AIDatabaseAdvisor()
-        ai_recommendation = ai_advisor.get_ai_recommendation(data)
-        
-        # Gerar recomendações tradicionais
-        recommendations = _generate_database_recommendations(data)
+        previous_analysis_id = data.get("previous_analysis_id")
+        if previous_analysis_id is not None and not isinstance(previous_analysis_id, str):
+            return jsonify({"success": False, "error": "previous_analysis_id deve ser uma string"}), 400
         
-        # Gerar sugestões de arquitetura
-        architecture_suggestions = _generate_architecture_suggestions(data, recommendations)
+        context = {
+            "started_at": started_at,
+            "budget": _get_request_budget(data),
+            "degraded": False,
+            "ai_cacheable": False
+        }
         
-        # Definir fluxo de dados
-        data_flow = _define_data_flow(data.get('requirements', {}))
+        # Recalcular apenas as seções cujas entradas mudaram
+        results, recomputed = _run_analysis_sections(data, context)
         
-        # Considerações importantes
-        considerations = _generate_considerations(data)
+        analysis_id = uuid.uuid4().hex
+        analysis_store.set(analysis_id, {"data": data, "results": results})
         
         response = {
             "success": True,
-            "recommendations": recommendations,
-            "architecture_suggestions": architecture_suggestions,
-            "data_flow": data_flow,
-            "considerations": considerations,
-            "ai_analysis": ai_recommendation,  # 🔥 NOVO campo
+            **results,
+            "degraded": context["degraded"],
+            "analysis_id": analysis_id,
+            "recomputed_sections": recomputed,
             "agent_type": "database_agent"
         }
         
+        if previous_analysis_id:
+            response["diff"] = _diff_analysis(previous_analysis_id, data, results)
+        
+        # Envia ao orquestrador em segundo plano, sem bloquear a resposta
+        delivery_queue = get_delivery_queue()
+        if delivery_queue is not None:
+            delivery_queue.enqueue({"project_name": data.get("project_name"), **response})
+        
         return jsonify(response)
         
     except Exception as e:
         logger.error(f"Erro no agente de banco de dados: {e}")
         return jsonify({"success": False, "error": f"Erro interno: {str(e)}"}), 500
 
+def _get_request_budget(data: Dict[str, Any]) -> Optional[float]:
+    """Lê o orçamento de tempo do cliente (header ou campo "request_timeout")"""
+    raw_budget = request.headers.get(DEADLINE_HEADER, data.get("request_timeout"))
+    if raw_budget is None:
+        return None
+    
+    try:
+        budget = float(raw_budget)
+    except (TypeError, ValueError):
+        budget = math.nan
+    
+    if not math.isfinite(budget):
+        logger.warning(f"Orçamento de tempo inválido ignorado: {raw_budget!r}")
+        return None
+    return max(budget, 0.0)
+
 def _generate_database_recommendations(data: Dict[str, Any]) -> List[Dict[str, Any]]:
     """Gera recomendações de banco de dados baseadas nos requisitos"""
     recommendations = []
@@ -215,10 +357,125 @@ def _generate_considerations(data: Dict[str, Any]) -> List[str]:
     
     return considerations
 
+def _remaining_budget(context: Dict[str, Any]) -> Optional[float]:
+    """Segundos restantes do orçamento do cliente, já descontada a folga de resposta
+    (None se não houver prazo)"""
+    budget = context["budget"]
+    if budget is None:
+        return None
+    elapsed = time.monotonic() - context["started_at"]
+    return max(budget - elapsed - DEADLINE_MARGIN_SECONDS, 0.0)
+
+def _generate_ai_analysis(data: Dict[str, Any], context: Dict[str, Any]) -> str:
+    """Obtém a análise de IA dentro do prazo restante do cliente"""
+    # O prazo já vale para o teste de conexão feito no construtor
+    ai_advisor = AIDatabaseAdvisor(timeout=_remaining_budget(context))
+    
+    ai_recommendation = ai_advisor.get_ai_recommendation(data, timeout=_remaining_budget(context))
+    context["degraded"] = ai_advisor.degraded
+    # Só memoiza respostas reais da OpenAI ou a simulação quando não há chave;
+    # qualquer fallback deve tentar a OpenAI de novo na próxima requisição
+    context["ai_cacheable"] = ai_advisor.used_real_ai or not ai_advisor.api_key
+    return ai_recommendation
+
+# Seções da análise e suas dependências, na ordem de execução. A análise de IA
+# depende de todos os requisitos porque o prompt da OpenAI inclui o JSON inteiro
+ANALYSIS_SECTIONS = [
+    AnalysisSection(
+        "recommendations",
+        fields=("requirements.data_type", "requirements.high_read_throughput"),
+        compute=lambda data, results, context: _generate_database_recommendations(data)
+    ),
+    AnalysisSection(
+        "architecture_suggestions",
+        fields=("requirements.high_availability",),
+        depends_on=("recommendations",),
+        compute=lambda data, results, context: _generate_architecture_suggestions(data, results["recommendations"])
+    ),
+    AnalysisSection(
+        "data_flow",
+        fields=("requirements.high_read_throughput",),
+        compute=lambda data, results, context: _define_data_flow(data.get('requirements', {}))
+    ),
+    AnalysisSection(
+        "considerations",
+        fields=(
+            "requirements.data_volume",
+            "requirements.compliance_requirements",
+            "requirements.real_time_analytics"
+        ),
+        compute=lambda data, results, context: _generate_considerations(data)
+    ),
+    AnalysisSection(
+        "ai_analysis",
+        fields=("project_name", "project_description", "requirements"),
+        compute=lambda data, results, context: _generate_ai_analysis(data, context),
+        cacheable=lambda context: context["ai_cacheable"]
+    ),
+]
+
+def _run_analysis_sections(data: Dict[str, Any], context: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str]]:
+    """Executa as seções, reaproveitando as que já foram calculadas com as mesmas entradas"""
+    results = {}
+    keys = {}
+    recomputed = []
+    
+    for section in ANALYSIS_SECTIONS:
+        key = section.cache_key(data, keys)
+        keys[section.name] = key
+        
+        cached = section_cache.get(key)
+        if cached is not None:
+            results[section.name] = cached
+            continue
+        
+        results[section.name] = section.compute(data, results, context)
+        recomputed.append(section.name)
+        if section.cacheable(context):
+            section_cache.set(key, results[section.name])
+    
+    return results, recomputed
+
+def _diff_analysis(previous_analysis_id: str, data: Dict[str, Any], results: Dict[str, Any]) -> Dict[str, Any]:
+    """Compara a análise atual com uma análise anterior armazenada"""
+    previous = analysis_store.get(previous_analysis_id)
+    if previous is None:
+        return {"previous_analysis_id": previous_analysis_id, "found": False}
+    
+    previous_requirements = previous["data"].get("requirements", {})
+    requirements = data.get("requirements", {})
+    changed_requirements = sorted(
+        field for field in set(previous_requirements) | set(requirements)
+        if previous_requirements.get(field) != requirements.get(field)
+    )
+    
+    changed_sections = [
+        name for name in results
+        if previous["results"].get(name) != results[name]
+    ]
+    
+    return {
+        "previous_analysis_id": previous_analysis_id,
+        "found": True,
+        "changed_requirements": changed_requirements,
+        "changed_sections": changed_sections,
+        "unchanged_sections": [name for name in results if name not in changed_sections],
+        "changes": {
+            name: {"before": previous["results"].get(name), "after": results[name]}
+            for name in changed_sections
+        }
+    }
+
 if __name__ == '__main__':
     logger.info("🚀 Iniciando Database Agent com Flask...")
+    debug = True
+    
+    # Com o reloader do debug, só o processo filho (WERKZEUG_RUN_MAIN) atende requisições
+    if not debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        get_delivery_queue()
+    
     app.run(
         host='0.0.0.0',
         port=8004,
-        debug=True
+        debug=debug
     )
\ No newline at end of file
@@ -0,0 +1,6 @@
+# Configuração do gunicorn, carregada automaticamente do diretório de trabalho
+
+def post_worker_init(worker):
+    """Cria a fila de entrega de cada worker na inicialização, reenviando o spool pendente"""
+    from database_agent import get_delivery_queue
+    get_delivery_queue()
@@ -0,0 +1,126 @@
+import os
+import sys
+import time
+import hmac
+import random
+import logging
+import threading
+import functools
+from collections import Counter
+from typing import Callable
+from flask import request
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Profiling sob demanda (desativado por padrão). Com PROFILING_ENABLED=false o
+# decorator devolve a função original, sem nenhum custo por requisição
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN", "")
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "0.0"))
+PROFILING_INTERVAL = float(os.getenv("PROFILING_INTERVAL", "0.005"))
+PROFILING_OUTPUT_DIR = os.getenv("PROFILING_OUTPUT_DIR", ".profiles")
+# Retenção: só os N profiles mais recentes são mantidos em PROFILING_OUTPUT_DIR
+PROFILING_MAX_FILES = int(os.getenv("PROFILING_MAX_FILES", "100"))
+
+# Header que marca uma requisição para profiling; o valor deve ser o PROFILING_TOKEN
+PROFILE_HEADER = "X-Profile-Token"
+
+class StackSampler:
+    """Profiler por amostragem de uma única thread
+    
+    Uma thread auxiliar lê a pilha da thread alvo a cada `interval` segundos
+    e acumula as pilhas no formato "collapsed" (frames separados por ";"
+    seguidos da contagem), aceito por flamegraph.pl, inferno e speedscope.
+    """
+    
+    def __init__(self, thread_id: int, interval: float = PROFILING_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+    
+    def start(self) -> None:
+        self._thread.start()
+    
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+    
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.samples[self._collapse(frame)] += 1
+    
+    @staticmethod
+    def _collapse(frame) -> str:
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        return ";".join(reversed(stack))
+    
+    def write(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.samples.items():
+                f.write(f"{stack} {count}\n")
+
+def _should_profile() -> bool:
+    """Requisição marcada com o token correto ou sorteada pela taxa de amostragem"""
+    token = request.headers.get(PROFILE_HEADER)
+    if token is not None and PROFILING_TOKEN:
+        # Compara bytes: com str, compare_digest rejeita caracteres não ASCII
+        return hmac.compare_digest(token.encode("utf-8"), PROFILING_TOKEN.encode("utf-8"))
+    return random.random() < PROFILING_SAMPLE_RATE
+
+def profile_requests(func: Callable) -> Callable:
+    """Decorator que perfila o handler inteiro quando a requisição for selecionada"""
+    if not PROFILING_ENABLED:
+        return func
+    
+    os.makedirs(PROFILING_OUTPUT_DIR, exist_ok=True)
+    
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _should_profile():
+            return func(*args, **kwargs)
+        
+        sampler = StackSampler(threading.get_ident())
+        started_at = time.time()
+        sampler.start()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            sampler.stop()
+            # Requisições mais curtas que o intervalo não geram amostras
+            if sampler.samples:
+                _write_profile(func.__name__, sampler, started_at)
+    
+    return wrapper
+
+def _write_profile(name: str, sampler: StackSampler, started_at: float) -> None:
+    """Grava o profile e aplica a retenção de PROFILING_MAX_FILES"""
+    path = os.path.join(
+        PROFILING_OUTPUT_DIR,
+        f"{name}-{int(started_at * 1000)}-{threading.get_ident()}.folded"
+    )
+    try:
+        sampler.write(path)
+        logger.info(
+            f"Profile de {name} gravado em {path} "
+            f"({sum(sampler.samples.values())} amostras, {time.time() - started_at:.2f}s)"
+        )
+        
+        profiles = sorted(
+            (os.path.join(PROFILING_OUTPUT_DIR, file_name)
+             for file_name in os.listdir(PROFILING_OUTPUT_DIR) if file_name.endswith(".folded")),
+            key=os.path.getmtime
+        )
+        for old_profile in profiles[:max(0, len(profiles) - PROFILING_MAX_FILES)]:
+            os.remove(old_profile)
+    except OSError as e:
+        logger.error(f"Erro ao gravar profile: {e}")
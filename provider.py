@@ -1,14 +1,37 @@
 import requests
 import logging
-from typing import Dict, Any
+from typing import Dict, Any, Optional, List
 import openai
 import os
 import json
+import time
+import uuid
+import queue
+import random
+import threading
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def _try_lock_file(lock_file) -> bool:
+    """Tenta um lock exclusivo não bloqueante, liberado ao fechar o arquivo ou encerrar o processo"""
+    try:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
 class DatabaseProvider:
     def __init__(self):
         self.orchestrator_url = "http://localhost:3000"
@@ -46,6 +69,280 @@ class DatabaseProvider:
         
         return recommendations
 
+class OrchestratorDeliveryQueue:
+    """Entrega resultados ao orquestrador em lotes, fora da thread da requisição
+    
+    Os resultados são agrupados por tamanho (`batch_size`) e janela de tempo
+    (`batch_window` segundos) e enviados num único POST. Falhas transitórias
+    são retentadas com backoff exponencial até `max_attempts`; respostas 4xx
+    (exceto 408 e 429) são permanentes. Lotes que esgotam as tentativas são
+    descartados e contados em `dropped`, para não travar a fila.
+    
+    Spool: cada processo grava num subdiretório próprio de `spool_dir`
+    (`<spool_dir>/<pid>/`), protegido por um lock de arquivo mantido enquanto
+    o processo vive. Processos que compartilham o mesmo `spool_dir` (workers
+    do gunicorn, reloader do Flask) nunca leem nem apagam os itens uns dos
+    outros. Ao iniciar, um processo adota apenas os subdiretórios cujo lock
+    está livre, isto é, de processos já encerrados, e reenvia tudo logo na
+    criação da fila. Itens pendentes de um processo que morreu são reenviados
+    quando o próximo worker inicia, sem esperar por tráfego.
+    
+    `enqueue` grava o item no spool de forma síncrona (um arquivo pequeno,
+    escrito e renomeado) para que o resultado esteja em disco antes de a
+    resposta voltar ao cliente. Listagem, limpeza e envio ficam fora da
+    thread da requisição: o limite `max_spool_items` é aplicado com um índice
+    em memória dos arquivos do spool.
+    
+    A entrega é at-least-once: um item pode ser reenviado se o processo
+    morrer entre o POST aceito e a remoção do spool. O orquestrador deve
+    deduplicar pelo `delivery_id`.
+    
+    Crie a fila na inicialização de cada processo que atende requisições, e
+    não na importação do módulo, para que o pid do spool seja o do worker.
+    """
+    
+    def __init__(self, orchestrator_url: str, endpoint: str = "database-results",
+                 batch_size: int = 20, batch_window: float = 2.0,
+                 spool_dir: str = ".delivery_spool", max_spool_items: int = 500,
+                 base_backoff: float = 1.0, max_backoff: float = 60.0,
+                 max_attempts: int = 8, request_timeout: float = 10.0):
+        self.url = f"{orchestrator_url}/{endpoint}"
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.spool_root = spool_dir
+        self.spool_dir = os.path.join(spool_dir, str(os.getpid()))
+        self.max_spool_items = max_spool_items
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+        self.request_timeout = request_timeout
+        
+        self._queue = queue.Queue()
+        self._session = requests.Session()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._pending = {}  # delivery_id -> enqueued_at
+        self._spooled = OrderedDict()  # caminhos no spool, em ordem de chegada
+        self._stats = {
+            "delivered": 0,
+            "batches_sent": 0,
+            "failed_attempts": 0,
+            "dropped": 0,
+            "spool_dropped": 0,
+            "last_delivery_lag_seconds": None,
+            "max_delivery_lag_seconds": 0.0
+        }
+        
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self._spool_lock = open(os.path.join(self.spool_dir, ".lock"), "a+")
+        if not _try_lock_file(self._spool_lock):
+            raise RuntimeError(f"Spool de entrega {self.spool_dir} já está em uso por outro processo")
+        
+        self._adopt_orphaned_spools()
+        self._load_spool()
+    
+    def enqueue(self, result: Dict[str, Any]) -> str:
+        """Agenda um resultado para entrega e retorna seu delivery_id"""
+        enqueued_at = time.time()
+        item = {
+            "delivery_id": uuid.uuid4().hex,
+            "enqueued_at": enqueued_at,
+            "result": result
+        }
+        self._write_spool(item)
+        self._put(item)
+        return item["delivery_id"]
+    
+    def get_metrics(self) -> Dict[str, Any]:
+        """Métricas de entrega, incluindo o atraso do item pendente mais antigo"""
+        with self._lock:
+            oldest = min(self._pending.values()) if self._pending else None
+            return {
+                **self._stats,
+                "pending": len(self._pending),
+                "oldest_pending_age_seconds": time.time() - oldest if oldest else 0.0
+            }
+    
+    def _put(self, item: Dict[str, Any]) -> None:
+        with self._lock:
+            self._pending[item["delivery_id"]] = item["enqueued_at"]
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(
+                    target=self._run, name="orchestrator-delivery", daemon=True
+                )
+                self._worker.start()
+        self._queue.put(item)
+    
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch()
+            self._deliver(batch)
+    
+    def _next_batch(self) -> List[Dict[str, Any]]:
+        """Bloqueia até o primeiro item e completa o lote até encher ou fechar a janela"""
+        batch = [self._queue.get()]
+        window_end = time.monotonic() + self.batch_window
+        
+        while len(batch) < self.batch_size:
+            remaining = window_end - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        
+        return batch
+    
+    def _deliver(self, batch: List[Dict[str, Any]]) -> None:
+        """Envia o lote, retentando com backoff enquanto a falha for transitória"""
+        attempt = 0
+        while True:
+            try:
+                response = self._session.post(
+                    self.url,
+                    json={"results": batch},
+                    timeout=self.request_timeout
+                )
+                response.raise_for_status()
+                break
+            except Exception as e:
+                attempt += 1
+                with self._lock:
+                    self._stats["failed_attempts"] += 1
+                
+                if self._is_permanent_failure(e) or attempt >= self.max_attempts:
+                    logger.error(
+                        f"Descartando lote de {len(batch)} resultado(s) após {attempt} tentativa(s): {e}. "
+                        f"delivery_ids: {[item['delivery_id'] for item in batch]}"
+                    )
+                    self._finish(batch, delivered=False)
+                    return
+                
+                delay = self._backoff_delay(attempt)
+                logger.warning(
+                    f"Falha ao entregar lote de {len(batch)} resultado(s) ao orquestrador "
+                    f"(tentativa {attempt}): {e}. Nova tentativa em {delay:.1f}s"
+                )
+                time.sleep(delay)
+        
+        self._finish(batch, delivered=True)
+    
+    def _backoff_delay(self, attempt: int) -> float:
+        """Backoff exponencial com jitter, limitado a `max_backoff`"""
+        delay = min(self.max_backoff, self.base_backoff * 2 ** (attempt - 1))
+        return delay * random.uniform(0.5, 1.0)
+    
+    @staticmethod
+    def _is_permanent_failure(error: Exception) -> bool:
+        """Respostas 4xx não mudam com retentativas, exceto timeout (408) e rate limit (429)"""
+        response = getattr(error, "response", None)
+        if not isinstance(error, requests.HTTPError) or response is None:
+            return False
+        return 400 <= response.status_code < 500 and response.status_code not in (408, 429)
+    
+    def _finish(self, batch: List[Dict[str, Any]], delivered: bool) -> None:
+        """Tira o lote da fila pendente e do spool, entregue ou descartado"""
+        finished_at = time.time()
+        with self._lock:
+            for item in batch:
+                self._pending.pop(item["delivery_id"], None)
+            
+            if delivered:
+                for item in batch:
+                    lag = finished_at - item["enqueued_at"]
+                    self._stats["last_delivery_lag_seconds"] = lag
+                    self._stats["max_delivery_lag_seconds"] = max(self._stats["max_delivery_lag_seconds"], lag)
+                self._stats["delivered"] += len(batch)
+                self._stats["batches_sent"] += 1
+            else:
+                self._stats["dropped"] += len(batch)
+        
+        for item in batch:
+            self._remove_spool(item)
+    
+    def _spool_path(self, item: Dict[str, Any]) -> str:
+        # Prefixo com timestamp mantém a ordem de chegada na recarga
+        return os.path.join(self.spool_dir, f"{int(item['enqueued_at'] * 1e6)}-{item['delivery_id']}.json")
+    
+    def _write_spool(self, item: Dict[str, Any]) -> None:
+        path = self._spool_path(item)
+        with self._lock:
+            self._spooled[path] = None
+            # Spool cheio: descarta os mais antigos (continuam na fila em memória)
+            overflow = []
+            while len(self._spooled) > self.max_spool_items:
+                overflow.append(self._spooled.popitem(last=False)[0])
+            self._stats["spool_dropped"] += len(overflow)
+        
+        for old_path in overflow:
+            logger.warning(f"Spool de entrega cheio, descartando {os.path.basename(old_path)}")
+            self._delete_spool_file(old_path)
+        
+        try:
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(item, f, default=str)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.error(f"Erro ao gravar spool de entrega: {e}")
+    
+    def _remove_spool(self, item: Dict[str, Any]) -> None:
+        path = self._spool_path(item)
+        with self._lock:
+            self._spooled.pop(path, None)
+        self._delete_spool_file(path)
+    
+    @staticmethod
+    def _delete_spool_file(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"Erro ao remover item do spool de entrega: {e}")
+    
+    def _adopt_orphaned_spools(self) -> None:
+        """Move para o spool próprio os itens de processos já encerrados"""
+        for name in os.listdir(self.spool_root):
+            orphan_dir = os.path.join(self.spool_root, name)
+            if orphan_dir == self.spool_dir or not os.path.isdir(orphan_dir):
+                continue
+            
+            try:
+                with open(os.path.join(orphan_dir, ".lock"), "a+") as lock_file:
+                    # Lock ocupado: o dono ainda está vivo
+                    if not _try_lock_file(lock_file):
+                        continue
+                    for spooled in os.listdir(orphan_dir):
+                        if spooled.endswith(".json"):
+                            os.replace(os.path.join(orphan_dir, spooled), os.path.join(self.spool_dir, spooled))
+                os.remove(os.path.join(orphan_dir, ".lock"))
+                os.rmdir(orphan_dir)
+                logger.info(f"Spool de entrega órfão adotado: {orphan_dir}")
+            except OSError as e:
+                logger.warning(f"Não foi possível adotar o spool {orphan_dir}: {e}")
+    
+    def _load_spool(self) -> None:
+        """Reenfileira resultados não entregues antes do último reinício"""
+        for name in sorted(os.listdir(self.spool_dir)):
+            path = os.path.join(self.spool_dir, name)
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(path, encoding="utf-8") as f:
+                    item = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.error(f"Item inválido no spool de entrega ({name}), descartando: {e}")
+                os.remove(path)
+                continue
+            with self._lock:
+                self._spooled[path] = None
+            self._put(item)
+        
+        if self._pending:
+            logger.info(f"{len(self._pending)} resultado(s) recuperado(s) do spool de entrega")
+
 class DatabasePatterns:
     """Padrões de banco de dados comuns"""
     
@@ -77,7 +374,11 @@ class DatabasePatterns:
         }
 
 class AIDatabaseAdvisor:
-    def __init__(self, api_key: str = None):
+    # Tempo típico (segundos) de uma resposta completa da OpenAI; abaixo disso
+    # não vale a pena iniciar a chamada
+    typical_response_seconds = float(os.getenv("AI_TYPICAL_RESPONSE_SECONDS", "20"))
+
+    def __init__(self, api_key: str = None, timeout: Optional[float] = None):
         # DEBUG: Mostrar o que está acontecendo
         print(f"\n🔍 DEBUG AIDatabaseAdvisor.__init__()")
         print(f"   api_key passada: {'✅ SIM' if api_key else '❌ NÃO'}")
@@ -93,28 +394,49 @@ class AIDatabaseAdvisor:
                 print(f"   Chave (mascarada): {self.api_key[:8]}...{self.api_key[-4:]}")
         
         self.use_real_ai = False
+        self.degraded = False
+        # True apenas quando a última análise veio de fato da OpenAI
+        self.used_real_ai = False
+        self.client = None
+        # Chave configurada, mas a OpenAI não será usada (orçamento insuficiente
+        # ou falha no teste de conexão)
+        self.openai_skipped = False
         
         # Tentar configurar OpenAI se tiver chave
-        if self.api_key:
+        if self.api_key and timeout is not None and timeout < self.typical_response_seconds:
+            print(f"   ⏱️  Orçamento de {timeout:.1f}s insuficiente, OpenAI não será consultada")
+            self.openai_skipped = True
+        elif self.api_key:
             try:
                 print("   🚀 Tentando configurar OpenAI...")
-                openai.api_key = self.api_key
+                self.client = openai.OpenAI(api_key=self.api_key)
                 # Testar a conexão com uma requisição simples
-                self._test_openai_connection()
+                self._test_openai_connection(timeout)
                 self.use_real_ai = True
                 print("   ✅ OpenAI GPT-4o Mini configurado com sucesso!")
             except Exception as e:
                 print(f"   ⚠️  OpenAI não disponível: {e}")
                 self.use_real_ai = False
+                self.openai_skipped = True
         else:
             print("   ✅ Modo simulação ativado (sem chave OpenAI)")
     
-    def _test_openai_connection(self):
+    def _get_client(self, timeout: Optional[float] = None):
+        """Cliente OpenAI limitado ao orçamento restante
+        
+        Com prazo definido, as retentativas automáticas são desligadas: o
+        `timeout` do SDK vale por tentativa e não limitaria a espera total.
+        """
+        if timeout is None:
+            return self.client
+        return self.client.with_options(timeout=timeout, max_retries=0)
+    
+    def _test_openai_connection(self, timeout: Optional[float] = None):
         """Testa a conexão com a OpenAI"""
         try:
             print("   🧪 Testando conexão com OpenAI...")
             # Requisição de teste leve
-            test_response = openai.chat.completions.create(
+            test_response = self._get_client(timeout).chat.completions.create(
                 model="gpt-4o-mini",
                 messages=[{"role": "user", "content": "Test"}],
                 max_tokens=5
@@ -128,15 +450,31 @@ class AIDatabaseAdvisor:
             print(f"   ❌ Outro erro OpenAI: {e}")
             raise Exception(f"Falha ao conectar com OpenAI: {e}")
     
-    def get_ai_recommendation(self, project_data: Dict[str, Any]) -> str:
-        """Fornece análise de IA - OpenAI se disponível, simulada caso contrário"""
+    def get_ai_recommendation(self, project_data: Dict[str, Any], timeout: Optional[float] = None) -> str:
+        """Fornece análise de IA - OpenAI se disponível, simulada caso contrário
         
-        if self.use_real_ai:
-            return self._get_openai_recommendation(project_data)
-        else:
+        `timeout` é o orçamento restante do cliente em segundos. Se não cobrir
+        uma resposta típica da OpenAI, a chamada nem é iniciada. Sempre que a
+        OpenAI estava disponível mas a análise simulada foi usada no lugar,
+        `self.degraded` fica True.
+        """
+        self.degraded = self.openai_skipped
+        self.used_real_ai = False
+        
+        if not self.use_real_ai:
             return self._get_simulated_ai_recommendation(project_data)
+        
+        if timeout is not None and timeout < self.typical_response_seconds:
+            logger.warning(
+                f"Orçamento de {timeout:.1f}s insuficiente para a OpenAI "
+                f"(típico: {self.typical_response_seconds:.1f}s). Usando modo simulação."
+            )
+            self.degraded = True
+            return self._get_simulated_ai_recommendation(project_data)
+        
+        return self._get_openai_recommendation(project_data, timeout=timeout)
     
-    def _get_openai_recommendation(self, project_data: Dict[str, Any]) -> str:
+    def _get_openai_recommendation(self, project_data: Dict[str, Any], timeout: Optional[float] = None) -> str:
         """Usa OpenAI GPT-4o Mini para análise real"""
         
         try:
@@ -176,7 +514,7 @@ class AIDatabaseAdvisor:
             Formate a resposta de forma clara com tópicos e bullet points.
             """
             
-            response = openai.chat.completions.create(
+            response = self._get_client(timeout).chat.completions.create(
                 model="gpt-4o-mini",
                 messages=[
                     {
@@ -191,21 +529,31 @@ class AIDatabaseAdvisor:
             )
             
             analysis = response.choices[0].message.content
+            self.used_real_ai = True
             return f"🤖 ANÁLISE OPENAI GPT-4o MINI:\n\n{analysis}"
         
+        except openai.APITimeoutError:
+            error_msg = "⏱️  Prazo do cliente esgotado aguardando a OpenAI. Usando modo simulação."
+            print(error_msg)
+            self.degraded = True
+            return self._get_simulated_ai_recommendation(project_data)
+        
         except openai.AuthenticationError:
             error_msg = "❌ Erro de autenticação OpenAI. Verifique sua API_KEY no arquivo .env"
             print(error_msg)
+            self.degraded = True
             return f"{error_msg}\n\nUsando modo simulação:\n{self._get_simulated_ai_recommendation(project_data)}"
         
         except openai.RateLimitError:
             error_msg = "⚠️  Limite de taxa excedido na OpenAI. Usando modo simulação."
             print(error_msg)
+            self.degraded = True
             return self._get_simulated_ai_recommendation(project_data)
         
         except Exception as e:
             error_msg = f"❌ Erro na OpenAI: {str(e)[:100]}... Usando modo simulação."
             print(error_msg)
+            self.degraded = True
             return self._get_simulated_ai_recommendation(project_data)
     
     def _get_simulated_ai_recommendation(self, project_data: Dict[str, Any]) -> str:
@@ -0,0 +1,24 @@
+import pytest
+import database_agent
+from database_agent import app, LRUCache
+
+@pytest.fixture
+def client(monkeypatch):
+    """Cliente Flask com caches de seção e análises isolados por teste"""
+    monkeypatch.setattr(database_agent, "section_cache", LRUCache(64))
+    monkeypatch.setattr(database_agent, "analysis_store", LRUCache(64))
+    return app.test_client()
+
+@pytest.fixture
+def project_data():
+    return {
+        "project_name": "Test Project",
+        "project_description": "A test project for database analysis",
+        "requirements": {
+            "data_type": "structured",
+            "scalability": "high",
+            "consistency": "strong",
+            "high_read_throughput": True,
+            "high_availability": False
+        }
+    }
@@ -0,0 +1,198 @@
+import json
+import os
+import threading
+import time
+import requests
+import provider
+from provider import OrchestratorDeliveryQueue, _try_lock_file
+
+class FakeResponse:
+    def __init__(self, status_code: int = 200):
+        self.status_code = status_code
+    
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} Error", response=self)
+
+class FakeSession:
+    """Sessão falsa que registra os lotes e responde com os status programados"""
+    
+    def __init__(self, statuses=None, gate: threading.Event = None):
+        self.statuses = list(statuses or [])
+        self.gate = gate
+        self.batches = []
+    
+    def post(self, url, json, timeout):
+        if self.gate is not None:
+            self.gate.wait(5)
+        self.batches.append([item["result"] for item in json["results"]])
+        return FakeResponse(self.statuses.pop(0) if self.statuses else 200)
+
+def _make_queue(tmp_path, session=None, **kwargs):
+    options = {"batch_window": 0.05, "base_backoff": 0.01, "spool_dir": str(tmp_path / "spool")}
+    options.update(kwargs)
+    delivery_queue = OrchestratorDeliveryQueue("http://orchestrator", **options)
+    delivery_queue._session = session or FakeSession()
+    return delivery_queue
+
+def _wait_for(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condição não atingida a tempo"
+        time.sleep(0.01)
+
+def _spooled(delivery_queue):
+    return [name for name in os.listdir(delivery_queue.spool_dir) if name.endswith(".json")]
+
+def test_batches_are_closed_by_size(tmp_path):
+    session = FakeSession()
+    delivery_queue = _make_queue(tmp_path, session, batch_size=3, batch_window=0.5)
+    
+    for i in range(7):
+        delivery_queue.enqueue({"i": i})
+    _wait_for(lambda: delivery_queue.get_metrics()["delivered"] == 7)
+    
+    assert [len(batch) for batch in session.batches] == [3, 3, 1]
+    assert [item["i"] for batch in session.batches for item in batch] == list(range(7))
+
+def test_batches_are_closed_by_time_window(tmp_path):
+    session = FakeSession()
+    delivery_queue = _make_queue(tmp_path, session, batch_size=100, batch_window=0.2)
+    
+    delivery_queue.enqueue({"i": 0})
+    delivery_queue.enqueue({"i": 1})
+    _wait_for(lambda: delivery_queue.get_metrics()["delivered"] == 2)
+    
+    metrics = delivery_queue.get_metrics()
+    assert [len(batch) for batch in session.batches] == [2]
+    assert metrics["batches_sent"] == 1
+    assert metrics["max_delivery_lag_seconds"] >= 0.15
+
+def test_transient_failures_are_retried(tmp_path):
+    session = FakeSession(statuses=[503, 429])
+    delivery_queue = _make_queue(tmp_path, session)
+    
+    delivery_queue.enqueue({"i": 0})
+    _wait_for(lambda: delivery_queue.get_metrics()["delivered"] == 1)
+    
+    metrics = delivery_queue.get_metrics()
+    assert len(session.batches) == 3
+    assert metrics["failed_attempts"] == 2
+    assert metrics["dropped"] == 0
+    assert _spooled(delivery_queue) == []
+
+def test_backoff_grows_exponentially_up_to_the_cap(tmp_path, monkeypatch):
+    monkeypatch.setattr(provider.random, "uniform", lambda low, high: high)
+    delivery_queue = _make_queue(tmp_path, base_backoff=1.0, max_backoff=5.0)
+    
+    assert [delivery_queue._backoff_delay(attempt) for attempt in range(1, 6)] == [1.0, 2.0, 4.0, 5.0, 5.0]
+
+def test_permanent_client_error_drops_batch_and_keeps_delivering(tmp_path):
+    session = FakeSession(statuses=[400])
+    delivery_queue = _make_queue(tmp_path, session, batch_size=1)
+    
+    delivery_queue.enqueue({"i": "rejeitado"})
+    delivery_queue.enqueue({"i": "aceito"})
+    _wait_for(lambda: delivery_queue.get_metrics()["delivered"] == 1)
+    
+    metrics = delivery_queue.get_metrics()
+    assert session.batches == [[{"i": "rejeitado"}], [{"i": "aceito"}]]
+    assert metrics["dropped"] == 1
+    assert metrics["pending"] == 0
+    assert _spooled(delivery_queue) == []
+
+def test_batch_is_dropped_after_max_attempts(tmp_path):
+    session = FakeSession(statuses=[503, 503, 503])
+    delivery_queue = _make_queue(tmp_path, session, batch_size=1, max_attempts=3)
+    
+    delivery_queue.enqueue({"i": 0})
+    delivery_queue.enqueue({"i": 1})
+    _wait_for(lambda: delivery_queue.get_metrics()["delivered"] == 1)
+    
+    metrics = delivery_queue.get_metrics()
+    assert len(session.batches) == 4
+    assert metrics["failed_attempts"] == 3
+    assert metrics["dropped"] == 1
+    assert _spooled(delivery_queue) == []
+
+def test_each_process_spools_to_its_own_directory(tmp_path):
+    delivery_queue = _make_queue(tmp_path, FakeSession(gate=threading.Event()))
+    
+    delivery_queue.enqueue({"i": 0})
+    
+    assert delivery_queue.spool_dir == str(tmp_path / "spool" / str(os.getpid()))
+    assert len(_spooled(delivery_queue)) == 1
+
+def test_orphaned_spool_is_recovered_on_restart(tmp_path):
+    orphan_dir = tmp_path / "spool" / "99999"
+    orphan_dir.mkdir(parents=True)
+    item = {"delivery_id": "abc", "enqueued_at": time.time(), "result": {"i": "recuperado"}}
+    (orphan_dir / f"{int(item['enqueued_at'] * 1e6)}-abc.json").write_text(json.dumps(item))
+    session = FakeSession()
+    
+    delivery_queue = _make_queue(tmp_path, session)
+    _wait_for(lambda: delivery_queue.get_metrics()["delivered"] == 1)
+    
+    assert session.batches == [[{"i": "recuperado"}]]
+    assert not orphan_dir.exists()
+    assert _spooled(delivery_queue) == []
+
+def test_spool_of_a_live_process_is_not_adopted(tmp_path):
+    live_dir = tmp_path / "spool" / "88888"
+    live_dir.mkdir(parents=True)
+    (live_dir / "1-abc.json").write_text(json.dumps({"delivery_id": "abc", "enqueued_at": 1, "result": {}}))
+    
+    with open(live_dir / ".lock", "a+") as lock_file:
+        assert _try_lock_file(lock_file)
+        delivery_queue = _make_queue(tmp_path)
+    
+    assert (live_dir / "1-abc.json").exists()
+    assert delivery_queue.get_metrics()["pending"] == 0
+
+def test_spool_is_trimmed_to_max_items(tmp_path):
+    gate = threading.Event()
+    session = FakeSession(gate=gate)
+    delivery_queue = _make_queue(tmp_path, session, batch_size=1, batch_window=0, max_spool_items=2)
+    
+    for i in range(4):
+        delivery_queue.enqueue({"i": i})
+    
+    assert len(_spooled(delivery_queue)) == 2
+    assert delivery_queue.get_metrics()["spool_dropped"] == 2
+    
+    # Itens cortados do spool ainda são entregues enquanto o processo vive
+    gate.set()
+    _wait_for(lambda: delivery_queue.get_metrics()["delivered"] == 4)
+    assert _spooled(delivery_queue) == []
+
+def test_enqueue_does_not_list_the_spool_directory(tmp_path, monkeypatch):
+    delivery_queue = _make_queue(tmp_path, FakeSession(gate=threading.Event()), max_spool_items=2)
+    listed = []
+    listdir = os.listdir
+    monkeypatch.setattr(provider.os, "listdir", lambda path=".": listed.append(path) or listdir(path))
+    
+    for i in range(5):
+        delivery_queue.enqueue({"i": i})
+    monkeypatch.undo()
+    
+    assert listed == []
+    assert len(_spooled(delivery_queue)) == 2
+
+def test_metrics_report_pending_items_and_lag(tmp_path):
+    gate = threading.Event()
+    delivery_queue = _make_queue(tmp_path, FakeSession(gate=gate))
+    
+    delivery_queue.enqueue({"i": 0})
+    time.sleep(0.1)
+    metrics = delivery_queue.get_metrics()
+    
+    assert metrics["pending"] == 1
+    assert metrics["oldest_pending_age_seconds"] >= 0.1
+    assert metrics["last_delivery_lag_seconds"] is None
+    
+    gate.set()
+    _wait_for(lambda: delivery_queue.get_metrics()["delivered"] == 1)
+    metrics = delivery_queue.get_metrics()
+    assert metrics["pending"] == 0
+    assert metrics["oldest_pending_age_seconds"] == 0.0
+    assert metrics["last_delivery_lag_seconds"] >= 0.1
@@ -0,0 +1,107 @@
+import os
+import re
+import sys
+import threading
+import time
+import pytest
+import database_agent
+import profiling
+from database_agent import app
+from profiling import StackSampler, profile_requests
+
+class SlowAdvisor:
+    """Advisor falso lento o bastante para gerar amostras"""
+    
+    def __init__(self, timeout=None):
+        self.api_key = None
+        self.degraded = False
+        self.used_real_ai = False
+    
+    def get_ai_recommendation(self, project_data, timeout=None):
+        time.sleep(0.05)
+        return "analise"
+
+@pytest.fixture
+def profiles_dir(client, monkeypatch, tmp_path):
+    """Ativa o profiler e reaplica o decorator ao handler, sem memoização de seções"""
+    monkeypatch.setattr(database_agent, "section_cache", database_agent.LRUCache(0))
+    monkeypatch.setattr(profiling, "PROFILING_ENABLED", True)
+    monkeypatch.setattr(profiling, "PROFILING_TOKEN", "s3cret")
+    monkeypatch.setattr(profiling, "PROFILING_SAMPLE_RATE", 0.0)
+    monkeypatch.setattr(profiling, "PROFILING_OUTPUT_DIR", str(tmp_path))
+    monkeypatch.setattr(profiling, "PROFILING_MAX_FILES", 100)
+    monkeypatch.setattr(StackSampler.__init__, "__defaults__", (0.001,))
+    monkeypatch.setattr(database_agent, "AIDatabaseAdvisor", SlowAdvisor)
+    monkeypatch.setitem(app.view_functions, "analyze_database", profile_requests(database_agent.analyze_database))
+    return tmp_path
+
+def _profiles(directory):
+    return sorted(name for name in os.listdir(directory) if name.endswith(".folded"))
+
+def test_disabled_profiler_returns_handler_unchanged(monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILING_ENABLED", False)
+    handler = lambda: None
+    
+    assert profile_requests(handler) is handler
+
+def test_correct_token_writes_folded_profile(client, project_data, profiles_dir):
+    response = client.post("/analyze-database", json=project_data, headers={"X-Profile-Token": "s3cret"})
+    
+    assert response.status_code == 200
+    assert len(_profiles(profiles_dir)) == 1
+
+@pytest.mark.parametrize("token", ["errado", "sécret", ""])
+def test_wrong_token_is_not_profiled(client, project_data, profiles_dir, token):
+    response = client.post("/analyze-database", json=project_data, headers={"X-Profile-Token": token})
+    
+    assert response.status_code == 200
+    assert _profiles(profiles_dir) == []
+
+def test_sampling_follows_sample_rate(client, project_data, profiles_dir, monkeypatch):
+    client.post("/analyze-database", json=project_data)
+    assert _profiles(profiles_dir) == []
+    
+    monkeypatch.setattr(profiling, "PROFILING_SAMPLE_RATE", 1.0)
+    client.post("/analyze-database", json=project_data)
+    assert len(_profiles(profiles_dir)) == 1
+
+def test_request_without_samples_writes_no_file(client, project_data, profiles_dir, monkeypatch):
+    monkeypatch.setattr(StackSampler.__init__, "__defaults__", (10.0,))
+    
+    client.post("/analyze-database", json=project_data, headers={"X-Profile-Token": "s3cret"})
+    
+    assert _profiles(profiles_dir) == []
+
+def test_output_dir_keeps_only_most_recent_profiles(client, project_data, profiles_dir, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILING_MAX_FILES", 2)
+    
+    for _ in range(4):
+        client.post("/analyze-database", json=project_data, headers={"X-Profile-Token": "s3cret"})
+    
+    assert len(_profiles(profiles_dir)) == 2
+
+def test_profile_uses_collapsed_stack_format(client, project_data, profiles_dir):
+    client.post("/analyze-database", json=project_data, headers={"X-Profile-Token": "s3cret"})
+    
+    (profile,) = _profiles(profiles_dir)
+    lines = (profiles_dir / profile).read_text(encoding="utf-8").splitlines()
+    
+    assert lines
+    for line in lines:
+        assert re.fullmatch(r"[^;\n]+(;[^;\n]+)* \d+", line), line
+    # A pilha vai da raiz à folha e cobre o handler e o advisor
+    assert any("analyze_database (database_agent.py:" in line and "get_ai_recommendation" in line for line in lines)
+
+def test_collapse_orders_frames_root_first(tmp_path):
+    def leaf():
+        return StackSampler._collapse(sys._getframe())
+    
+    frames = leaf().split(";")
+    
+    assert frames[-1].startswith("leaf (test_profiling.py:")
+    assert frames[-2].startswith("test_collapse_orders_frames_root_first (test_profiling.py:")
+    
+    sampler = StackSampler(threading.get_ident())
+    sampler.samples.update({"main (app.py:1);handler (app.py:10)": 3})
+    sampler.write(str(tmp_path / "out.folded"))
+    assert (tmp_path / "out.folded").read_text(encoding="utf-8") == "main (app.py:1);handler (app.py:10) 3\n"
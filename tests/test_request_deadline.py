@@ -0,0 +1,115 @@
+import pytest
+from types import SimpleNamespace
+import openai
+import database_agent
+from provider import AIDatabaseAdvisor
+
+class FakeOpenAI:
+    """Cliente OpenAI falso que registra as opções de cada chamada
+    
+    `failures` lista exceções levantadas, em ordem, pelas próximas chamadas.
+    """
+    instances = []
+    failures = []
+    
+    def __init__(self, api_key):
+        self.options = []
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=self)
+        FakeOpenAI.instances.append(self)
+    
+    def with_options(self, **options):
+        self.options.append(options)
+        return self
+    
+    def create(self, **kwargs):
+        self.calls += 1
+        if FakeOpenAI.failures:
+            raise FakeOpenAI.failures.pop(0)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="ok"))])
+
+class RecordingAdvisor:
+    """Advisor falso que registra o orçamento recebido"""
+    timeouts = []
+    
+    def __init__(self, timeout=None):
+        self.api_key = None
+        self.degraded = False
+        self.used_real_ai = False
+    
+    def get_ai_recommendation(self, project_data, timeout=None):
+        RecordingAdvisor.timeouts.append(timeout)
+        return "analise"
+
+@pytest.fixture
+def fake_openai(monkeypatch):
+    FakeOpenAI.instances = []
+    FakeOpenAI.failures = []
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test-key-1234")
+    monkeypatch.setattr(openai, "OpenAI", FakeOpenAI)
+    return FakeOpenAI
+
+def test_budget_below_typical_response_is_degraded_without_calling_openai(client, project_data, fake_openai):
+    response = client.post(
+        "/analyze-database",
+        json=project_data,
+        headers={"X-Request-Timeout": str(AIDatabaseAdvisor.typical_response_seconds / 2)}
+    )
+    data = response.get_json()
+    
+    assert response.status_code == 200
+    assert data["degraded"] is True
+    assert "MODO SIMULAÇÃO" in data["ai_analysis"]
+    assert data["recommendations"]
+    assert fake_openai.instances == []
+
+def test_budget_in_request_field_is_honored(client, project_data, fake_openai):
+    project_data["request_timeout"] = 1
+    
+    data = client.post("/analyze-database", json=project_data).get_json()
+    
+    assert data["degraded"] is True
+    assert fake_openai.instances == []
+
+def test_sufficient_budget_caps_openai_calls_without_retries(client, project_data, fake_openai):
+    budget = AIDatabaseAdvisor.typical_response_seconds * 3
+    
+    data = client.post(
+        "/analyze-database", json=project_data, headers={"X-Request-Timeout": str(budget)}
+    ).get_json()
+    
+    assert data["degraded"] is False
+    assert "OPENAI" in data["ai_analysis"]
+    (fake,) = fake_openai.instances
+    assert fake.calls == 2  # teste de conexão + análise
+    assert all(option["max_retries"] == 0 for option in fake.options)
+    assert all(0 < option["timeout"] <= budget - database_agent.DEADLINE_MARGIN_SECONDS for option in fake.options)
+
+def test_connection_test_failure_marks_response_degraded(client, project_data, fake_openai):
+    fake_openai.failures = [TimeoutError("prazo esgotado no teste de conexão")]
+    budget = AIDatabaseAdvisor.typical_response_seconds * 3
+    
+    data = client.post(
+        "/analyze-database", json=project_data, headers={"X-Request-Timeout": str(budget)}
+    ).get_json()
+    
+    assert data["degraded"] is True
+    assert "MODO SIMULAÇÃO" in data["ai_analysis"]
+
+@pytest.mark.parametrize("raw_budget", ["abc", "nan", "inf", "-inf"])
+def test_invalid_budget_header_is_ignored(client, project_data, monkeypatch, raw_budget):
+    RecordingAdvisor.timeouts = []
+    monkeypatch.setattr(database_agent, "AIDatabaseAdvisor", RecordingAdvisor)
+    
+    response = client.post("/analyze-database", json=project_data, headers={"X-Request-Timeout": raw_budget})
+    
+    assert response.status_code == 200
+    assert RecordingAdvisor.timeouts == [None]
+
+def test_without_api_key_response_is_not_degraded(client, project_data, monkeypatch):
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    
+    data = client.post("/analyze-database", json=project_data, headers={"X-Request-Timeout": "1"}).get_json()
+    
+    assert data["degraded"] is False
+    assert "MODO SIMULAÇÃO" in data["ai_analysis"]
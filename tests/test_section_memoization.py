@@ -0,0 +1,141 @@
+import pytest
+from types import SimpleNamespace
+import openai
+import database_agent
+
+class DegradedAdvisor:
+    """Advisor falso que sempre cai para a análise simulada"""
+    calls = 0
+    
+    def __init__(self, timeout=None):
+        self.api_key = "sk-test-key-1234"
+        self.degraded = False
+        self.used_real_ai = False
+    
+    def get_ai_recommendation(self, project_data, timeout=None):
+        DegradedAdvisor.calls += 1
+        self.degraded = True
+        return "analise simulada"
+
+class FlakyOpenAI:
+    """Cliente OpenAI falso cujo primeiro teste de conexão falha"""
+    calls = 0
+    
+    def __init__(self, api_key):
+        self.chat = SimpleNamespace(completions=self)
+    
+    def with_options(self, **options):
+        return self
+    
+    def create(self, **kwargs):
+        FlakyOpenAI.calls += 1
+        if FlakyOpenAI.calls == 1:
+            raise TimeoutError("falha transitória")
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="analise real"))])
+
+@pytest.fixture(autouse=True)
+def no_openai(monkeypatch):
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+
+def _toggle(project_data, field):
+    toggled = dict(project_data)
+    toggled["requirements"] = {**project_data["requirements"], field: not project_data["requirements"].get(field, False)}
+    return toggled
+
+def test_first_analysis_recomputes_every_section(client, project_data):
+    data = client.post("/analyze-database", json=project_data).get_json()
+    
+    assert data["recomputed_sections"] == [section.name for section in database_agent.ANALYSIS_SECTIONS]
+
+def test_identical_request_is_fully_memoized(client, project_data):
+    first = client.post("/analyze-database", json=project_data).get_json()
+    second = client.post("/analyze-database", json=project_data).get_json()
+    
+    assert second["recomputed_sections"] == []
+    assert second["recommendations"] == first["recommendations"]
+    assert second["ai_analysis"] == first["ai_analysis"]
+
+def test_toggling_high_availability_recomputes_only_dependent_sections(client, project_data):
+    client.post("/analyze-database", json=project_data)
+    
+    data = client.post("/analyze-database", json=_toggle(project_data, "high_availability")).get_json()
+    
+    assert data["recomputed_sections"] == ["architecture_suggestions", "ai_analysis"]
+    assert data["architecture_suggestions"]["replication"] == "Ativar"
+
+@pytest.mark.parametrize("field", [
+    "high_availability",
+    "high_read_throughput",
+    "compliance_requirements",
+    "real_time_analytics"
+])
+def test_memoized_sections_match_a_fresh_run(client, project_data, monkeypatch, field):
+    """Protege as tuplas `fields` de ANALYSIS_SECTIONS contra dependências esquecidas"""
+    client.post("/analyze-database", json=project_data)
+    toggled = _toggle(project_data, field)
+    
+    memoized = client.post("/analyze-database", json=toggled).get_json()
+    monkeypatch.setattr(database_agent, "section_cache", database_agent.LRUCache(64))
+    fresh = client.post("/analyze-database", json=toggled).get_json()
+    
+    for section in database_agent.ANALYSIS_SECTIONS:
+        assert memoized[section.name] == fresh[section.name], section.name
+
+def test_degraded_ai_analysis_is_not_cached(client, project_data, monkeypatch):
+    DegradedAdvisor.calls = 0
+    monkeypatch.setattr(database_agent, "AIDatabaseAdvisor", DegradedAdvisor)
+    
+    first = client.post("/analyze-database", json=project_data).get_json()
+    second = client.post("/analyze-database", json=project_data).get_json()
+    
+    assert first["degraded"] is True
+    assert second["recomputed_sections"] == ["ai_analysis"]
+    assert DegradedAdvisor.calls == 2
+
+def test_fallback_after_failed_connection_test_is_not_cached(client, project_data, monkeypatch):
+    FlakyOpenAI.calls = 0
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test-key-1234")
+    monkeypatch.setattr(openai, "OpenAI", FlakyOpenAI)
+    
+    first = client.post("/analyze-database", json=project_data).get_json()
+    second = client.post("/analyze-database", json=project_data).get_json()
+    third = client.post("/analyze-database", json=project_data).get_json()
+    
+    assert first["degraded"] is True
+    assert "MODO SIMULAÇÃO" in first["ai_analysis"]
+    assert second["recomputed_sections"] == ["ai_analysis"]
+    assert second["degraded"] is False
+    assert "analise real" in second["ai_analysis"]
+    # A resposta real da OpenAI é memoizada
+    assert third["recomputed_sections"] == []
+    assert third["ai_analysis"] == second["ai_analysis"]
+
+def test_diff_against_known_previous_analysis(client, project_data):
+    first = client.post("/analyze-database", json=project_data).get_json()
+    
+    toggled = _toggle(project_data, "high_availability")
+    toggled["previous_analysis_id"] = first["analysis_id"]
+    diff = client.post("/analyze-database", json=toggled).get_json()["diff"]
+    
+    assert diff["found"] is True
+    assert diff["changed_requirements"] == ["high_availability"]
+    assert diff["changed_sections"] == ["architecture_suggestions", "ai_analysis"]
+    assert "recommendations" in diff["unchanged_sections"]
+    assert diff["changes"]["architecture_suggestions"]["before"]["replication"] == "Opcional"
+    assert diff["changes"]["architecture_suggestions"]["after"]["replication"] == "Ativar"
+
+def test_diff_against_unknown_previous_analysis(client, project_data):
+    project_data["previous_analysis_id"] = "desconhecido"
+    
+    data = client.post("/analyze-database", json=project_data).get_json()
+    
+    assert data["diff"] == {"previous_analysis_id": "desconhecido", "found": False}
+
+@pytest.mark.parametrize("previous_analysis_id", [["a"], {"id": "a"}, 42])
+def test_non_string_previous_analysis_id_is_rejected(client, project_data, previous_analysis_id):
+    project_data["previous_analysis_id"] = previous_analysis_id
+    
+    response = client.post("/analyze-database", json=project_data)
+    
+    assert response.status_code == 400
+    assert response.get_json()["success"] is False